@@ -1,10 +1,16 @@
-from datetime import datetime
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+import functools
 import logging
 import os
 
 import aiohttp
 from dotenv import load_dotenv
-from pymongo.errors import PyMongoError
+import pymongo
+from pymongo import AsyncMongoClient, WriteConcern
+from pymongo.errors import BulkWriteError, PyMongoError
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
 from typing import Annotated, List
 from livekit.agents import (
@@ -17,14 +23,212 @@ from livekit.agents import (
 )
 from livekit.agents.pipeline import VoicePipelineAgent
 from livekit.plugins import deepgram, silero, openai
-import pymongo
 
 
 load_dotenv(dotenv_path=".env.local")
 logger = logging.getLogger("voice-agent")
 
+# Shared asyncio client; operations run on the event loop over one connection
+# pool, so tools never block audio processing on a DB round-trip.
+_mongo = AsyncMongoClient(
+    os.environ.get("MONGODB_URI"),
+    maxPoolSize=20,
+    minPoolSize=2,
+    serverSelectionTimeoutMS=3000,
+)
+_db = _mongo["cafi_db"]
+interviews_collection = _db["interviews"]
+questions_collection = _db["questions"]
+# Answers are append-only, so a primary-only, unjournaled ack keeps replication
+# latency off the turn-taking path
+answers_collection = _db.get_collection(
+    "answers", write_concern=WriteConcern(w=1, j=False)
+)
+
+
+@functools.lru_cache(maxsize=256)
+def _oid(value: str) -> ObjectId:
+    """Parse an ObjectId string, reusing the result for ids seen before."""
+    return ObjectId(value)
+
+
+# Serves the questions $lookup on question_set_id in _id (insertion) order
+QUESTION_SET_INDEX = [("question_set_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+
+# The only index on answers besides _id. Every extra index adds a B-tree write to
+# each answer insert, so keep it that way; ad-hoc searches such as full-text on
+# answer belong in an offline index, not on this collection.
+ANSWER_INDEX = [("interview_id", pymongo.ASCENDING), ("question_number", pymongo.ASCENDING)]
+
+
+def create_indexes():
+    """Create the indexes the interview tools rely on, outside of any job."""
+    try:
+        # A short-lived sync client, since prewarm runs without an event loop
+        with pymongo.MongoClient(
+            os.environ.get("MONGODB_URI"), serverSelectionTimeoutMS=3000
+        ) as client:
+            db = client[_db.name]
+            db[questions_collection.name].create_index(QUESTION_SET_INDEX)
+            db[answers_collection.name].create_index(ANSWER_INDEX)
+
+    except PyMongoError:
+        # The tools work without the indexes, only slower; the next process retries
+        logger.exception("Error creating database indexes")
+
+
+async def warm_connection():
+    """Open a pooled connection before the participant's first tool call."""
+    try:
+        # Pays the TCP/TLS/auth handshake ahead of time
+        await _mongo.admin.command("ping")
+
+    except PyMongoError:
+        # Warming is only an optimization; the tools surface real DB problems
+        logger.exception("Error connecting to the database")
+
+
+# BSON stores datetimes as UTC, so take the timestamp in UTC directly instead of
+# local time
+_utcnow = functools.partial(datetime.now, timezone.utc)
+
+# Answers are buffered per interview and written in batches of this size.
+ANSWER_BATCH_SIZE = 5
+
+DUPLICATE_KEY_ERROR = 11000
+
 
 class InterviewQuestionsFnc(llm.FunctionContext):
+    def __init__(self):
+        super().__init__()
+        self._answer_buffers = defaultdict(list)
+        # Questions fetched per interview_id, reused for repeated tool calls
+        self._questions: dict[str, List[str]] = {}
+        # Index of the next question to hand out per interview_id
+        self._next_question: dict[str, int] = {}
+        # Question fetches in flight per interview_id
+        self._loading: dict[str, asyncio.Task] = {}
+
+    async def _flush_answers(self, interview_id: str):
+        buffered = self._answer_buffers.get(interview_id)
+        if not buffered:
+            return
+
+        batch = list(buffered)
+        try:
+            # Unordered so the server can apply the batch in parallel
+            await answers_collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Keep only the documents the server rejected. A duplicate key means
+            # an earlier attempt already stored that document.
+            failed = {
+                error["index"]
+                for error in e.details["writeErrors"]
+                if error["code"] != DUPLICATE_KEY_ERROR
+            }
+            self._forget_answers(interview_id, [doc for i, doc in enumerate(batch) if i not in failed])
+            if failed:
+                raise
+        else:
+            self._forget_answers(interview_id, batch)
+
+    async def flush_answers(self, interview_id: str):
+        """Write any answers still buffered for the interview."""
+        try:
+            await self._flush_answers(interview_id)
+        except PyMongoError:
+            # Log the error
+            logger.exception("Error storing buffered answers for interview %s", interview_id)
+            raise
+
+    def end_interview(self, interview_id: str):
+        """Drop the cached questions and position so a rejoin starts from the first question."""
+        self._questions.pop(interview_id, None)
+        self._next_question.pop(interview_id, None)
+
+    def _forget_answers(self, interview_id: str, written: List[dict]):
+        written_ids = {doc["_id"] for doc in written}
+        # Answers saved while the batch was in flight stay buffered
+        buffered = self._answer_buffers[interview_id]
+        buffered[:] = [doc for doc in buffered if doc["_id"] not in written_ids]
+        if not buffered:
+            del self._answer_buffers[interview_id]
+
+    async def _load_questions(self, interview_id: str) -> List[str]:
+        if interview_id in self._questions:
+            return self._questions[interview_id]
+        # Shielded so a cancelled tool call doesn't abort a fetch others await
+        return await asyncio.shield(self._start_loading(interview_id))
+
+    def _start_loading(self, interview_id: str) -> asyncio.Task:
+        # Join a fetch already in flight, e.g. the prefetch, instead of repeating it
+        task = self._loading.get(interview_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_questions(interview_id))
+            task.add_done_callback(functools.partial(self._questions_loaded, interview_id))
+            self._loading[interview_id] = task
+        return task
+
+    def _questions_loaded(self, interview_id: str, task: asyncio.Task):
+        # Failed fetches are dropped so the next call retries
+        del self._loading[interview_id]
+        if not task.cancelled() and task.exception() is None:
+            self._questions[interview_id] = task.result()
+
+    async def _fetch_questions(self, interview_id: str) -> List[str]:
+        try:
+            # Fetch the interview and its question set in a single round-trip.
+            # question_set_id is an ObjectId on interviews but a string on
+            # questions, so it is stringified before the join.
+            pipeline = [
+                {"$match": {"_id": _oid(interview_id)}},
+                {"$addFields": {"question_set_id_str": {"$toString": "$question_set_id"}}},
+                {
+                    "$lookup": {
+                        "from": questions_collection.name,
+                        "localField": "question_set_id_str",
+                        "foreignField": "question_set_id",
+                        "as": "questions",
+                        # Questions must be asked in the order they were created
+                        "pipeline": [{"$sort": {"_id": 1}}, {"$project": {"_id": 0, "text": 1}}],
+                    }
+                },
+                {"$project": {"_id": 0, "questions.text": 1}},
+            ]
+            cursor = await interviews_collection.aggregate(pipeline)
+            results = await cursor.to_list(length=1)
+            interview = results[0] if results else None
+            if not interview:
+                raise ValueError(f"Interview with id {interview_id} not found.")
+            logger.debug(
+                "fetched interview id=%s questions=%d", interview_id, len(interview["questions"])
+            )
+
+            return [question["text"] for question in interview["questions"]]
+
+        except PyMongoError:
+            # Log the error
+            logger.exception("Error fetching interview questions")
+            raise
+
+    def prefetch_questions(self, interview_id: str):
+        """Start loading the questions ahead of the first tool call; failures resurface there."""
+        if interview_id in self._questions:
+            return
+        task = self._start_loading(interview_id)
+        task.add_done_callback(functools.partial(self._log_prefetch_failure, interview_id))
+
+    @staticmethod
+    def _log_prefetch_failure(interview_id: str, task: asyncio.Task):
+        if task.cancelled():
+            return
+        error = task.exception()
+        # PyMongoError tracebacks are already logged by _fetch_questions
+        if error is not None and not isinstance(error, PyMongoError):
+            logger.warning(
+                "Could not prefetch questions for interview %s", interview_id, exc_info=error
+            )
+
     @llm.ai_callable()
     async def get_interview_questions(
         self,
@@ -33,34 +237,43 @@ class InterviewQuestionsFnc(llm.FunctionContext):
         ],
     ):
         """
-        Retrieves a list of interview questions for the interview question set based on the interview's question_set_id.
+        Loads the interview questions for the interview question set based on the interview's question_set_id.
+
+        Returns the number of questions and the first question; use get_next_question to retrieve the rest one at a time.
         """
-        try:
-            # Connect to MongoDB
-            client = pymongo.MongoClient(os.environ.get("MONGODB_URI"))
-            db = client["cafi_db"]
-            interviews_collection = db["interviews"]
-
-            # Fetch the interview document using the provided interview_id
-            interview = interviews_collection.find_one({"_id": ObjectId(interview_id)})
-            print("fetched interview", interview)
-            if not interview:
-                raise ValueError(f"Interview with id {interview_id} not found.")
+        questions = await self._load_questions(interview_id)
+        loaded = f"Loaded {len(questions)} questions."
+        if interview_id in self._next_question:
+            # Repeated call: hand back the current question rather than moving on
+            index = self._next_question[interview_id] - 1
+            return f"{loaded} {self._format_question(index, questions)}"
+
+        return f"{loaded} {self._take_next_question(interview_id, questions)}"
+
+    @llm.ai_callable()
+    async def get_next_question(
+        self,
+        interview_id: Annotated[
+            str, llm.TypeInfo(description="Unique identifier for the interview")
+        ],
+    ):
+        """
+        Retrieves the next interview question to ask, along with its question number.
+        """
+        questions = await self._load_questions(interview_id)
+        return self._take_next_question(interview_id, questions)
 
-            question_set_id = interview["question_set_id"]
-            question_set_id_str = str(question_set_id)
-            questions_collection = db["questions"]
+    def _take_next_question(self, interview_id: str, questions: List[str]) -> str:
+        index = self._next_question.get(interview_id, 0)
+        if index >= len(questions):
+            return "There are no more questions. The interview is complete."
 
-            # Retrieve all questions with the matching question_set_id
-            interview_question_set = questions_collection.find({"question_set_id": question_set_id_str})
-            # Return the questions as a newline-separated string
-            questions = [question["text"] for question in interview_question_set]
-            return "\n".join(questions)
+        self._next_question[interview_id] = index + 1
+        return self._format_question(index, questions)
 
-        except PyMongoError as e:
-            # Log the error
-            print(f"Error fetching interview questions: {e}")
-            raise
+    @staticmethod
+    def _format_question(index: int, questions: List[str]) -> str:
+        return f"Question {index + 1} of {len(questions)}: {questions[index]}"
 
     @llm.ai_callable()
     async def save_single_interview_answer(
@@ -86,46 +299,91 @@ class InterviewQuestionsFnc(llm.FunctionContext):
         
         Allows incremental saving of interview responses during the interview process.
         """
-        try:
-            # Connect to MongoDB
-            client = pymongo.MongoClient(os.environ.get("MONGODB_URI"))
-            db = client["cafi_db"]
-            answers_collection = db["answers"]
-
-            # Prepare single answer document
-            answer_document = {
-                "user_id": user_id,
-                "interview_id": interview_id,
-                "timestamp": datetime.now(),
-                "question_number": question_number,
-                "question": question,
-                "answer": answer
-            }
+        # Prepare single answer document; the id is assigned client-side so
+        # it can be returned before the buffered batch is written
+        answer_document = {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "interview_id": interview_id,
+            "timestamp": _utcnow(),
+            "question_number": question_number,
+            "question": question,
+            "answer": answer
+        }
 
-            # Insert the document
-            result = answers_collection.insert_one(answer_document)
+        buffered = self._answer_buffers[interview_id]
+        buffered.append(answer_document)
 
-            # Close the connection
-            client.close()
+        # Write the batch once it is full or the final question is answered
+        total = len(self._questions.get(interview_id, ()))
+        is_last = total > 0 and question_number >= total
+        if is_last or len(buffered) >= ANSWER_BATCH_SIZE:
+            try:
+                await self._flush_answers(interview_id)
+            except PyMongoError:
+                # The answer is already buffered, so reporting a failure would
+                # make the LLM save it twice; the next flush, finalize_interview
+                # or the shutdown callback retries the write
+                logger.exception("Error saving interview answer")
 
-            # Return the inserted document's ID
-            return str(result.inserted_id)
+        # Return the document's ID
+        return str(answer_document["_id"])
 
-        except PyMongoError as e:
-            # Log the error 
-            print(f"Error saving interview answer: {e}")
-            raise
+    @llm.ai_callable()
+    async def finalize_interview(
+        self,
+        interview_id: Annotated[
+            str, llm.TypeInfo(description="Unique identifier for the interview")
+        ],
+    ):
+        """
+        Stores any interview answers that have not been written to the database yet.
+
+        Must be called once after the final answer has been saved.
+        """
+        await self.flush_answers(interview_id)
+        return "Interview answers stored."
 
 
 fnc_ctx = InterviewQuestionsFnc()
 
+# System prompt for the interviewer; formatted with interview_id and user_id per session
+_SYSTEM_PROMPT = (
+    "You are Lexi, an AI interviewer conducting interview {interview_id} for user {user_id}. "
+    "Follow this exact workflow:\n"
+    "1. INTRODUCTION PHASE:\n"
+    "   - Fetch the questions for the interview using the provided interview_id; this also returns the first question.\n"
+    "   - Do not engage in casual conversation.\n\n"
+    "2. QUESTION HANDLING PHASE:\n"
+    "   - Ask each question exactly as provided, starting with the first question.\n"
+    "   - After each answer, immediately save the exact question/answer pair and retrieve the next question.\n"
+    "   - Continue until there are no more questions.\n\n"
+    "3. CONCLUSION PHASE:\n"
+    "   - After the final answer is saved, finalize the interview using the provided interview_id.\n"
+    "   - Then state 'Thank you, that concludes our interview'.\n"
+    "   - Briefly acknowledge the completion and shut down the session.\n\n"
+    "RULES:\n"
+    "- Never deviate from the provided questions or their order.\n"
+    "- No follow-up questions.\n"
+    "- If the user asks unrelated questions, respond with: 'Let's focus on the current interview question please'.\n"
+    "- End session after the final answer is stored and acknowledge the completion of the interview."
+)
+
 
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    # Build the provider clients before a participant is waiting on them
+    proc.userdata["stt"] = deepgram.STT()
+    proc.userdata["llm"] = openai.LLM(model="gpt-4o")
+    proc.userdata["tts"] = deepgram.tts.TTS(model="aura-asteria-en")
+    create_indexes()
 
 
 async def entrypoint(ctx: JobContext):
-    logger.info(f"Connecting to room {ctx.room.name}")
+    # Warm up MongoDB while the room connection and participant join are pending
+    database_ready = asyncio.create_task(warm_connection())
+
+    logger.info("Connecting to room %s", ctx.room.name)
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
 
     logger.info("Waiting for participant...")
@@ -134,36 +392,37 @@ async def entrypoint(ctx: JobContext):
     # Extract user_id and interview_id from participant identity (assuming the format "userId_interviewId")
     identity = participant.identity
     user_id, interview_id = identity.split("_", 1)
-    logger.info(f"Starting voice assistant for {user_id} (interview {interview_id})")
+    # Reject malformed ids now rather than mid-conversation inside a tool call
+    try:
+        _oid(interview_id)
+    except InvalidId as e:
+        raise ValueError(f"Invalid interview id {interview_id} in participant identity {identity}.") from e
+    logger.info("Starting voice assistant for %s (interview %s)", user_id, interview_id)
+
+    # Fetch the questions while the agent is set up and greets the participant
+    fnc_ctx.prefetch_questions(interview_id)
+
+    async def end_session():
+        # The warmup isn't awaited on the greeting path; settle it before the job ends
+        await database_ready
+        try:
+            # Make sure buffered answers reach the database even if the session ends early
+            await fnc_ctx.flush_answers(interview_id)
+        finally:
+            fnc_ctx.end_interview(interview_id)
+
+    ctx.add_shutdown_callback(end_session)
 
-    # Improved prompt for the agent
     initial_ctx = llm.ChatContext().append(
         role="system",
-        text=(
-            f"You are Lexi, an AI interviewer conducting interview {interview_id} for user {user_id}. "
-            "Follow this exact workflow:\n"
-            "1. INTRODUCTION PHASE:\n"
-            "   - Fetch the questions for the interview using the provided interview_id.\n"
-            "   - Do not engage in casual conversation.\n\n"
-            "2. QUESTION HANDLING PHASE:\n"
-            "   - Ask questions exactly as provided in the list, one at a time and in strict order.\n"
-            "   - After each answer, immediately save the exact question/answer pair and move to the next question.\n\n"
-            "3. CONCLUSION PHASE:\n"
-            "   - After the final answer is saved, state 'Thank you, that concludes our interview'.\n"
-            "   - Briefly acknowledge the completion and shut down the session.\n\n"
-            "RULES:\n"
-            "- Never deviate from the provided question list.\n"
-            "- No follow-up questions.\n"
-            "- If the user asks unrelated questions, respond with: 'Let's focus on the current interview question please'.\n"
-            "- End session after the final answer is stored and acknowledge the completion of the interview."
-        ),
+        text=_SYSTEM_PROMPT.format(interview_id=interview_id, user_id=user_id),
     )
 
     assistant = VoicePipelineAgent(
         vad=ctx.proc.userdata["vad"],
-        stt=deepgram.STT(),
-        llm=openai.LLM(model="gpt-4o"),
-        tts=deepgram.tts.TTS(model="aura-asteria-en"),
+        stt=ctx.proc.userdata["stt"],
+        llm=ctx.proc.userdata["llm"],
+        tts=ctx.proc.userdata["tts"],
         chat_ctx=initial_ctx,
         max_nested_fnc_calls=5,
         fnc_ctx=fnc_ctx,